@@ -188,8 +188,10 @@ class MainApp(ctk.CTk):
         """
         json_filename = os.path.join(participant_dir, f"Participant_{participant_num}_protocol.json")
         try:
+            # Serialize in memory, then write the whole document at once
+            payload = json.dumps(data, indent=4)
             with open(json_filename, "w") as json_file:
-                json.dump(data, json_file, indent=4)
+                json_file.write(payload)
             logging.info("Protocol JSON saved at %s", json_filename)
         except Exception as e:
             logging.error("Error saving protocol JSON: %s", e)
@@ -1,29 +1,45 @@
 import os
 import sys
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 sys.path.append("/Users/MA_Arash/MA_git/EIT_Thigh_Force_Estimation")
 
 from eit_utils import *
 from src.toolbox import Protocol
 
 
-parser = argparse.ArgumentParser(description="Process EIT data directory.")
-parser.add_argument("--base_dir", type=str, required=True, help="Base directory containing participant folders")
-args = parser.parse_args()
+def convert_participant(file_path: str, max_workers: int = None) -> None:
+    """Convert one participant folder; runs in its own worker process."""
+    print(f"Processing: {file_path}")
+    protocol = Protocol(file_path)
+    convert_eit_directory_to_npz(file_path, protocol, max_workers=max_workers)
 
-base_dir = args.base_dir
 
-# Automatically process all P01 - P15 folders
-participants = [f"P{p:02d}" for p in range(1, 16)]  # Generates P01, P02, ..., P15
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process EIT data directory.")
+    parser.add_argument("--base_dir", type=str, required=True, help="Base directory containing participant folders")
+    parser.add_argument("--workers", type=int, default=None, help="Participants converted in parallel (default: number of CPUs)")
+    args = parser.parse_args()
 
-for participant in participants:
-    file_path = os.path.join(base_dir, participant)
-    
-    if os.path.exists(file_path):  # Check if the folder exists
-        print(f"Processing: {file_path}")
-        protocol = Protocol(file_path)
-        convert_eit_directory_to_npz(file_path, protocol)
-    else:
-        print(f"Skipping {file_path}, folder does not exist.")
+    base_dir = args.base_dir
 
-print("Conversion completed!")
\ No newline at end of file
+    # Automatically process all P01 - P15 folders
+    participants = [f"P{p:02d}" for p in range(1, 16)]  # Generates P01, P02, ..., P15
+
+    file_paths = []
+    for participant in participants:
+        file_path = os.path.join(base_dir, participant)
+
+        if os.path.exists(file_path):  # Check if the folder exists
+            file_paths.append(file_path)
+        else:
+            print(f"Skipping {file_path}, folder does not exist.")
+
+    # Participants are independent; split the CPUs between them and each one's .eit file pool.
+    # ProcessPoolExecutor (not multiprocessing.Pool, whose daemonic workers cannot spawn) allows the nesting.
+    n_cpus = os.cpu_count() or 1
+    n_workers = max(1, min(len(file_paths), args.workers or n_cpus))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        list(executor.map(convert_participant, file_paths, [max(1, n_cpus // n_workers)] * len(file_paths)))
+
+    print("Conversion completed!")
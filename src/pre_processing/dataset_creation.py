@@ -5,13 +5,15 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from EIT_Thigh_Force_Estimation.src.pre_processing.pre_processing_utils import *
+from EIT_Thigh_Force_Estimation.src.pre_processing.eit_utils import load_eit_npz
+from EIT_Thigh_Force_Estimation.src.pre_processing.dataset_layout import DATASET_EIT_FILE, DATASET_META_FILE, DATASET_QUANT_FILE
 from scipy.signal import resample
 
 
 def load_data(path):
     """Load EIT, JSON, and isometric force data from the given directory."""
     json_path = glob.glob(f"{path}/*.json")[0]
-    eit_paths = glob.glob(f"{path}/eit_raw/**/*.npz", recursive=True)
+    eit_path = path  # the converted EIT archive is read via load_eit_npz(path)
     iso_csv_path = glob.glob(f"{path}/*.csv")[0]
     iso_py_path = f"{path}/iso_raw"
     
@@ -19,14 +21,14 @@ def load_data(path):
         json_data = json.load(file)
     
     iso_raw_df = pd.read_csv(iso_csv_path)
-    return eit_paths, json_data, iso_raw_df, iso_py_path
+    return eit_path, json_data, iso_raw_df, iso_py_path
 
 def process_isokinetic_force(iso_raw_df, iso_py_path, leg="right"):
     """Process Isokinetic force data from CSV and Python-based files."""
     iso_force_iso = IsoForceRAW(iso_raw_df, LP_filter_enabled=True, Leg=leg)
     iso_force_py = IsoForcePy(iso_py_path, Leg=leg, LP_filter_enabled=True, over_UTC=True, scale_0_1=True, distance=400)
     
-    return iso_force_iso, iso_force_py, np.array([t.timestamp() for t in iso_force_py.time])
+    return iso_force_iso, iso_force_py, np.array([t.timestamp() for t in iso_force_py.time.astype(object)])
 
 def process_json_information(json_data, torque_py_segments, torque_iso_segments):
     """Extract force levels and participant number from JSON data."""
@@ -35,18 +37,21 @@ def process_json_information(json_data, torque_py_segments, torque_iso_segments)
 
     force_levels = list(map(int, force_levels_str.strip("[]").split()))
     
-    if set(torque_py_segments.keys()) != set(torque_iso_segments.keys()):
+    if torque_py_segments.keys() != torque_iso_segments.keys():  # set-like views, no copies
         print(f" Target Level: {force_levels[0]} was removed")
         force_levels.pop(0)
 
     return force_levels, participant_num
 
-def process_torque_segments(torque_iso_segments, torque_py_segments):
-    """Process and align torque segments from ISO and PY sources."""
+def process_torque_segments(torque_iso_segments, torque_py_segments, plot=False):
+    """Process and align torque segments from ISO and PY sources.
+
+    With plot=True every aligned segment pair is shown with its correlation score.
+    """
     def extract_number(key):
         return int(key.split("_")[-1])
     
-    if set(torque_py_segments.keys()) != set(torque_iso_segments.keys()):
+    if torque_py_segments.keys() != torque_iso_segments.keys():
         iso_keys_sorted = sorted(torque_iso_segments.keys(), key=extract_number)
         py_keys_sorted = sorted(torque_py_segments.keys(), key=extract_number)
         iso_values = [torque_iso_segments[k] for k in iso_keys_sorted]
@@ -59,68 +64,122 @@ def process_torque_segments(torque_iso_segments, torque_py_segments):
         torque_py_segments = {f"T_seg_{i}": py_values[i] for i in range(min_length)}
     
     Iso_segments = []
-    for idx, key in enumerate(torque_iso_segments.keys()):
-        orig_min = np.min(torque_iso_segments[key])
-        orig_max = np.max(torque_iso_segments[key])
-        iso_seg = scale_to_range(torque_iso_segments[key])
+    for key, iso_torque in torque_iso_segments.items():
+        iso_torque = np.asarray(iso_torque)
+        orig_min = iso_torque.min()
+        orig_range = iso_torque.max() - orig_min
+        iso_seg = scale_to_range(iso_torque)
         py_seg = scale_to_range(torque_py_segments[key])
         iso_seg_corr, py_seg_corr = resample_signals(iso_seg, py_seg)
         shift = detect_shift(iso_seg_corr, py_seg_corr)
         iso_seg, py_seg = resample_signals(iso_seg[shift:], py_seg, target_length=1500)
-        Iso_segments.append(iso_seg * (orig_max - orig_min) + orig_min)
-        plt.figure(figsize=(6, 3))
-        plt.title(f"Correlation: {np.correlate(iso_seg, py_seg)[0] / len(iso_seg):.3f}")
-        plt.plot(iso_seg, "C7", label="iso")
-        plt.plot(py_seg, "C9", label="py")
-        plt.legend()
-        plt.show()
+        Iso_segments.append(iso_seg * orig_range + orig_min)
+        if plot:
+            plt.figure(figsize=(6, 3))
+            plt.title(f"Correlation: {np.dot(iso_seg, py_seg) / len(iso_seg):.3f}")
+            plt.plot(iso_seg, "C7", label="iso")
+            plt.plot(py_seg, "C9", label="py")
+            plt.legend()
+            plt.show()
     return Iso_segments
 
 def save_eit_samples(eit_pth, isoforce_py, isoforce_unix_time, isoforce_iso, force_levels, participant_num, dataset_path="./Dataset_test1"):
-    """Extract and save EIT samples with corresponding torque data."""
+    """Extract and save EIT samples with corresponding torque data.
+
+    eit_pth is the participant directory holding the converted EIT archive (see load_eit_npz).
+    All samples go into dataset_path: DATASET_EIT_FILE, a memory-mapped uint8 .npy of
+    shape (n_samples, n_el, n_el), and DATASET_META_FILE with the per-sample torque, target_force,
+    participant and timestamps arrays. The EIT magnitudes are quantized linearly between the
+    0.1 and 99.9 percentiles, which are stored in DATASET_QUANT_FILE for dequantization.
+
+    Samples already saved in dataset_path are kept and the new ones are appended after them. The
+    quantization range then becomes the union of the old and new ranges; the old samples are
+    requantized only if it changed. A directory with per-sample sample*.npz files from an older
+    version raises a ValueError; regenerate such datasets from scratch.
+    """
     os.makedirs(dataset_path, exist_ok=True)
-    existing_files = [f for f in os.listdir(dataset_path) if f.startswith("sample") and f.endswith(".npz")]
-    if existing_files:
-        existing_files.sort()
-        last_file = existing_files[-1]  # Get the last created sample file
-        last_index = int(last_file[6:11])  # Extract the numeric part from "sampleXXXXX.npz"
-        sample_counter = last_index + 1  # Continue from the last index
-    else:
-        sample_counter = 0  # Start from 0 if no files exist
-    
-    eit_data, eit_timestamps = [], []
-    for ele in np.sort(eit_pth):
-        tmp = np.load(ele, allow_pickle=True)
-        eit_data.append(tmp['eit']) 
-        eit_timestamps.append(tmp['timestamp'])
-    
-    eit_data = np.array(eit_data)
-    eit_data_abs = np.abs(eit_data) 
-    eit_timestamps = np.array(eit_timestamps)
-    
-    for i, (start, stop) in enumerate(zip(isoforce_py.start_idxs, isoforce_py.stop_idxs)):
-        
-        start_time = isoforce_unix_time[start]
-        stop_time = isoforce_unix_time[stop]
-        
-        start_idx = np.argmin(np.abs(eit_timestamps - start_time))
-        stop_idx = np.argmin(np.abs(eit_timestamps - stop_time))
-        
-        eit_segment = eit_data_abs[start_idx:stop_idx+1, :, :]
-        
+    eit_file = os.path.join(dataset_path, DATASET_EIT_FILE)
+    meta_file = os.path.join(dataset_path, DATASET_META_FILE)
+    quant_file = os.path.join(dataset_path, DATASET_QUANT_FILE)
+    if not os.path.exists(meta_file) and any(
+        name.startswith("sample") and name.endswith(".npz") for name in os.listdir(dataset_path)
+    ):
+        raise ValueError(
+            f"{dataset_path} holds per-sample sample*.npz files from an older version of save_eit_samples; "
+            "regenerate that dataset into an empty directory instead of appending to it"
+        )
+
+    eit_timestamps, eit_data = load_eit_npz(eit_pth)
+    eit_data_abs = np.abs(eit_data)
+    vmin, vmax = np.percentile(eit_data_abs, [0.1, 99.9])
+
+    # Continue from the samples already in dataset_path
+    old_eit, old_meta = None, {}
+    if os.path.exists(eit_file):
+        old_eit = np.load(eit_file, mmap_mode="r")
+        with np.load(meta_file) as meta:
+            old_meta = dict(meta)
+        with open(quant_file, "r") as file:
+            old_quant = json.load(file)
+        vmin, vmax = min(vmin, old_quant["vmin"]), max(vmax, old_quant["vmax"])
+    n_old = len(old_eit) if old_eit is not None else 0
+    quant_scale = 255.0 / (vmax - vmin) if vmax > vmin else 0.0
+
+    # Frame ranges first, so the output can be allocated once at its final size.
+    # Nearest EIT frame of every segment bound (first one on ties), via binary search on the sorted timestamps
+    bound_times = isoforce_unix_time[np.concatenate((isoforce_py.start_idxs, isoforce_py.stop_idxs))]
+    pos = np.clip(np.searchsorted(eit_timestamps, bound_times), 1, len(eit_timestamps) - 1)
+    nearest = pos - (np.abs(bound_times - eit_timestamps[pos - 1]) <= np.abs(bound_times - eit_timestamps[pos]))
+    start_idxs, stop_idxs = np.split(nearest, 2)
+    segments = list(zip(start_idxs.tolist(), (stop_idxs + 1).tolist()))
+    total = sum(max(stop - start, 0) for start, stop in segments)
+
+    # Written next to the old file and swapped in at the end, since the old samples are read from it
+    eit_out = np.lib.format.open_memmap(
+        eit_file + ".tmp", mode="w+", dtype=np.uint8, shape=(n_old + total, *eit_data_abs.shape[1:])
+    )
+    if n_old and (vmin, vmax) == (old_quant["vmin"], old_quant["vmax"]):
+        eit_out[:n_old] = old_eit
+    elif n_old:
+        old_step = (old_quant["vmax"] - old_quant["vmin"]) / 255.0
+        for chunk in range(0, n_old, 4096):
+            rows = slice(chunk, min(chunk + 4096, n_old))
+            old_values = old_eit[rows] * old_step + old_quant["vmin"]
+            eit_out[rows] = np.clip((old_values - vmin) * quant_scale + 0.5, 0, 255)
+    torque = np.empty(total, dtype=np.float64)
+    target_force = np.empty(total, dtype=np.int64)
+    timestamps = np.empty(total, dtype=np.float64)
+
+    sample_counter = 0
+    for i, (start_idx, stop_idx) in enumerate(segments):
+        eit_segment = eit_data_abs[start_idx:stop_idx]
+        n = len(eit_segment)
+        if n == 0:
+            continue
         torque_segment = isoforce_iso.torque_segments[f"T_seg_{i}"]
-        torque_resampled = resample(torque_segment, len(eit_segment))
-        target_force = force_levels[i]
-        
-        for j, (eit_frame, torque_value) in enumerate(zip(eit_segment, torque_resampled)):
-            filename = os.path.join(dataset_path, f"sample{sample_counter:05d}.npz")
-            timestamp = eit_timestamps[start_idx + j]
-            np.savez(filename,
-                     eit=eit_frame,
-                     torque=torque_value,
-                     timestmps=timestamp, 
-                     target_force=target_force, 
-                     participant=participant_num)
-            sample_counter += 1
-    
+
+        out_slice = slice(n_old + sample_counter, n_old + sample_counter + n)
+        eit_out[out_slice] = np.clip((eit_segment - vmin) * quant_scale + 0.5, 0, 255)
+        torque[sample_counter:sample_counter + n] = resample(torque_segment, n)
+        target_force[sample_counter:sample_counter + n] = force_levels[i]
+        timestamps[sample_counter:sample_counter + n] = eit_timestamps[start_idx:stop_idx]
+        sample_counter += n
+
+    eit_out.flush()
+    del eit_out, old_eit
+    os.replace(eit_file + ".tmp", eit_file)
+
+    new_meta = {
+        "torque": torque,
+        "target_force": target_force,
+        "participant": np.full(total, participant_num),
+        "timestamps": timestamps,
+    }
+    np.savez(meta_file, **{
+        key: np.concatenate((old_meta[key], values)) if key in old_meta else values
+        for key, values in new_meta.items()
+    })
+    with open(quant_file, "w") as file:
+        json.dump({"vmin": float(vmin), "vmax": float(vmax)}, file)
+
     print(f"Saved {sample_counter} samples successfully!")
@@ -0,0 +1,15 @@
+"""
+dataset_layout.py
+-----------------
+
+File names of a dataset directory, as written by dataset_creation.save_eit_samples and
+sync_utils.synchronize_eit_force_data and read by normalization_utils.load_data. This module has
+no project imports, so it can be imported with either the repository root or src/ on the path.
+"""
+
+# uint8 EIT magnitudes, shape (n_samples, n_el, n_el)
+DATASET_EIT_FILE = "eit.npy"
+# Per-sample torque, target_force, participant and timestamps arrays
+DATASET_META_FILE = "meta.npz"
+# {"vmin": ..., "vmax": ...} range of the uint8 quantization
+DATASET_QUANT_FILE = "quantization.json"
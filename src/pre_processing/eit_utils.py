@@ -1,11 +1,13 @@
 import os
 import sys
-from dataclasses import dataclass
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from glob import glob
 from os.path import join
+from typing import Dict, List, Optional, Tuple
 import numpy as np # type: ignore
 from src.toolbox import Protocol
+from src.pre_processing.time_utils import convert_timestamp
 from tqdm import tqdm
 
 sys.path.append("/Users/MA_Arash/MA_git/EIT_Thigh_Force_Estimation")
@@ -15,8 +17,17 @@ class SingleEitFrame:
     """Class to store a single frame of EIT measurement data."""
     setup_name: str = ""
     f_scale: str = ""
+    # Measurements of all electrode pairs as one contiguous (n_pairs, n_values) complex array;
+    # pairs maps an electrode pair key such as "1_7" to its row in data
+    pairs: Dict[str, int] = field(default_factory=dict)
+    data: np.ndarray = field(default_factory=lambda: np.empty((0, 0), dtype=np.complex128))
 
 
+# File name of the per-participant archive written by convert_eit_directory_to_npz
+EIT_ARCHIVE_NAME = "eit_frames.npz"
+# Frame stack written next to it as a plain .npy, so it can be memory-mapped
+EIT_DATA_NAME = "eit_data.npy"
+
 # List of header keys for .eit file parsing
 HEADER_KEYS = [
     "number_of_header", "file_version_number", "setup_name", "date_time",
@@ -42,7 +53,8 @@ def list_eit_files(path: str) -> list:
         Sorted list of .eit file names
     """
     try:
-        return np.sort([f for f in os.listdir(path) if f.endswith(".eit")])
+        with os.scandir(path) as entries:
+            return sorted(entry.name for entry in entries if entry.name.endswith(".eit"))
     except FileNotFoundError:
         print(f"Error: Directory not found - {path}")
         return []
@@ -73,25 +85,60 @@ def parse_eit_file_content(read_content: list) -> SingleEitFrame:
 
     frame.f_scale = "linear" if frame.f_scale == "0" else "logarithmic"
 
-    # Parse EIT measurement data
-    for i in range(len(HEADER_KEYS), len(read_content) - 1, 2):
-        el_cmb = "_".join(read_content[i].split())
-        lct = [float(ele.replace("E", "e")) for ele in read_content[i + 1].split("\t")]
-        fin_val = np.array([complex(lct[j], lct[j + 1]) for j in range(0, len(lct), 2)])
-
-        setattr(frame, el_cmb, fin_val)
+    # Parse EIT measurement data: electrode pair lines alternate with their tab-separated values
+    n_header = len(HEADER_KEYS)
+    pair_lines = read_content[n_header:len(read_content) - 1:2]
+    value_lines = read_content[n_header + 1::2]
+    frame.pairs = {"_".join(line.split()): row for row, line in enumerate(pair_lines)}
+
+    if len(value_lines) > 0 and len({line.count("\t") for line in value_lines}) == 1:
+        # Equal row lengths: parse all rows with one call into a single contiguous block
+        values = np.fromstring("\t".join(value_lines), dtype=np.float64, sep="\t").reshape(len(value_lines), -1)
+    elif len(value_lines) > 0:
+        rows = [np.fromstring(line, dtype=np.float64, sep="\t") for line in value_lines]
+        n_values = min(row.size for row in rows)
+        values = np.stack([row[:n_values] for row in rows])
+    else:
+        return frame
+    # Interleaved (real, imag) float pairs reinterpreted as complex128 without copying
+    frame.data = values[:, : values.shape[1] // 2 * 2].view(np.complex128)
 
     return frame
 
 
-def process_eit_files(target_path: str, skip: int = 5, n_el: int = 16):
+def read_eit_file(filepath: str) -> Optional[SingleEitFrame]:
     """
-    Processes .npz files, modifies electrode pairings, and updates data.
+    Reads and parses a single .eit file.
 
     Parameters
     ----------
-    target_path : str
-        Path to the directory containing .npz files
+    filepath : str
+        Path of the .eit file
+
+    Returns
+    -------
+    SingleEitFrame or None
+        Parsed EIT frame object, or None if the file could not be read
+    """
+    try:
+        with open(filepath, "r") as file:
+            # Iterate the file object to avoid holding the whole file as one string plus its split copy
+            read_content = [line.rstrip("\n") for line in file]
+    except Exception as e:
+        print(f"Error reading file {os.path.basename(filepath)}: {e}")
+        return None
+
+    return parse_eit_file_content(read_content)
+
+
+def process_eit_files(frames: List[SingleEitFrame], skip: int = 5, n_el: int = 16) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rearranges parsed EIT frames by electrode pairing into one measurement stack.
+
+    Parameters
+    ----------
+    frames : list of SingleEitFrame
+        Parsed EIT frames, in recording order
     skip : int, optional
         Number of electrodes to skip in pairing (default is 5)
     n_el : int, optional
@@ -99,24 +146,28 @@ def process_eit_files(target_path: str, skip: int = 5, n_el: int = 16):
 
     Returns
     -------
-    None
+    tuple of np.ndarray
+        complex128 array of shape (n_frames, n_el, n_el) and the UNIX timestamp of every frame
     """
-    filepaths = np.sort(glob(f"{target_path}/*.npz"))
-    for filepath in tqdm(filepaths, desc="Processing EIT .npz files", unit="file"):
-        tmp_eit = np.load(filepath, allow_pickle=True)
-
-        els = np.arange(1, n_el + 1)
-        matrix = np.zeros((n_el, n_el), dtype=complex)
-
-        for i1, i2 in zip(els, np.roll(els, -(skip + 1))):
-            matrix[i1 - 1, :n_el] = tmp_eit[f"{i1}_{i2}"][:n_el]
+    eit = np.empty((len(frames), n_el, n_el), dtype=np.complex128)
+    timestamps = np.empty(len(frames), dtype=np.float64)
+    # Row i1-1 holds the injection pair (i1, i2) with i2 = i1 + skip + 1 (wrapping around n_el);
+    # the pairing is the same for every frame
+    keys = [f"{i1}_{(i1 + skip) % n_el + 1}" for i1 in range(1, n_el + 1)]
+    for idx, frame in enumerate(tqdm(frames, desc="Processing EIT frames", unit="frame")):
+        eit[idx] = frame.data[[frame.pairs[key] for key in keys], :n_el]
+        timestamps[idx] = convert_timestamp(frame.date_time)
 
-        np.savez(filepath, eit=matrix, timestamp=convert_timestamp(tmp_eit["date_time"].tolist()))
+    return eit, timestamps
 
 
-def convert_eit_directory_to_npz(input_path: str, protocol: Protocol, output_path: str = None):
+def convert_eit_directory_to_npz(input_path: str, protocol: Protocol, output_path: str = None, max_workers: int = None):
     """
-    Converts all .eit files in a directory to .npz format.
+    Converts all .eit files in a directory into a single .npz archive.
+
+    The files are independent, so they are read and parsed in parallel worker processes.
+    The frames are then stored as EIT_DATA_NAME, a (n_frames, n_el, n_el) complex .npy, and
+    EIT_ARCHIVE_NAME with the keys "timestamps" (n_frames,) and "setup_names" (n_frames,).
 
     Parameters
     ----------
@@ -125,7 +176,9 @@ def convert_eit_directory_to_npz(input_path: str, protocol: Protocol, output_pat
     protocol : Protocol
         Measurement protocol object
     output_path : str, optional
-        Directory to save .npz files 
+        Directory to save the .npz archive (default is input_path/eit_processed)
+    max_workers : int, optional
+        Number of worker processes (default is the number of CPUs)
 
     Returns
     -------
@@ -145,45 +198,42 @@ def convert_eit_directory_to_npz(input_path: str, protocol: Protocol, output_pat
         print(f"No .eit files found in {input_path}")
         return
 
-    print("Converting .eit to .npz...")
-    for filename in eit_files:
-        filepath = join(file_path, filename)
-
-        try:
-            with open(filepath, "r") as file:
-                read_content = file.read().split("\n")
-        except Exception as e:
-            print(f"Error reading file {filename}: {e}")
-            continue
+    print("Reading .eit files...")
+    filepaths = [join(file_path, filename) for filename in eit_files]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        frames = [frame for frame in executor.map(read_eit_file, filepaths, chunksize=4) if frame is not None]
 
-        frame = parse_eit_file_content(read_content)
-        save_filepath = join(output_path, f"{frame.setup_name}.npz")
-        np.savez(save_filepath, **frame.__dict__)
-        print(f"Saved: {save_filepath}")
+    print("Reshaping EIT frames...")
+    eit, timestamps = process_eit_files(frames, skip=protocol.EITMeasurement.injection_skip, n_el=protocol.EITMeasurement.n_el)
 
-    print("Reshaping .npz data...")
-    process_eit_files(target_path=output_path, skip=protocol.EITMeasurement.injection_skip, n_el=protocol.EITMeasurement.n_el)
+    save_filepath = join(output_path, EIT_DATA_NAME)
+    np.save(save_filepath, eit)
+    np.savez_compressed(
+        join(output_path, EIT_ARCHIVE_NAME),
+        timestamps=timestamps,
+        setup_names=np.array([frame.setup_name for frame in frames]),
+    )
+    print(f"Saved {len(frames)} frames: {save_filepath}")
 
 
-def convert_timestamp(date_str: str):
+def load_eit_npz(path: str, mmap_mode: Optional[str] = "r") -> Tuple[np.ndarray, np.ndarray]:
     """
-    Converts date string to a timestamp.
+    Loads the converted EIT archive of a participant.
 
     Parameters
     ----------
-    date_str : str
-        Date in the format "YYYY.MM.DD. HH:MM:SS.FFF"
+    path : str
+        Participant directory passed to convert_eit_directory_to_npz
+    mmap_mode : str, optional
+        np.load memory-map mode of the EIT measurements (default is "r", read-only; None loads them
+        into memory). Frames are then only read from disk when indexed.
 
     Returns
     -------
-    float or str
-        Converted timestamp or formatted datetime string
+    tuple of np.ndarray
+        UNIX timestamps (n_frames,) and EIT measurements (n_frames, n_el, n_el)
     """
-    try:
-        if len(str(date_str).split(".")) > 2:
-            return datetime.strptime(date_str, "%Y.%m.%d. %H:%M:%S.%f").timestamp()
-        else:
-            return datetime.fromtimestamp(float(date_str)).strftime("%Y.%m.%d. %H:%M:%S.%f")
-    except Exception as e:
-        print(f"Error converting timestamp: {e}")
-        return date_str
+    output_path = join(path, "eit_processed")
+    with np.load(join(output_path, EIT_ARCHIVE_NAME)) as archive:
+        timestamps = archive["timestamps"]
+    return timestamps, np.load(join(output_path, EIT_DATA_NAME), mmap_mode=mmap_mode)
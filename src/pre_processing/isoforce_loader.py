@@ -1,7 +1,9 @@
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from glob import glob
-from typing import Tuple
+from typing import Iterable, List, Optional, Tuple
 
 import pandas as pd
 
@@ -66,3 +68,36 @@ def process_isoforce_data(
         iso_force_py.plot_torque()
 
     return iso_force_raw, iso_force_py
+
+
+def process_isoforce_cohort(
+    data_paths: Iterable[str],
+    segment_length_threshold: int,
+    distance: float,
+    max_workers: Optional[int] = None
+) -> List[Tuple[IsoForceRAW, IsoForcePy]]:
+    """
+    Load and preprocess IsoForce measurement data for several participants concurrently.
+
+    Participants are independent and the heavy kernels (CSV parsing, sosfiltfilt,
+    find_peaks, NumPy reductions) release the GIL, so they are processed in a thread
+    pool. The cached low-pass filter design shared between threads is only read.
+
+    Args:
+        data_paths: Participant directories, each as accepted by process_isoforce_data.
+        segment_length_threshold: Minimum length (in samples) of valid segments.
+        distance: Peak-detection distance threshold.
+        max_workers: Number of threads (default: number of CPUs).
+
+    Returns:
+        One (iso_force_raw, iso_force_py) tuple per participant, in input order.
+    """
+    data_paths = list(data_paths)
+    logger.info("Processing IsoForce data for %d participants", len(data_paths))
+    load_one = partial(
+        process_isoforce_data,
+        segment_length_threshold=segment_length_threshold,
+        distance=distance,
+    )
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        return list(executor.map(load_one, data_paths))
@@ -1,34 +1,100 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor
 from os.path import join
-from glob import glob
 from tqdm import tqdm
 from sklearn.decomposition import PCA
 import seaborn as sns
 
+from pre_processing.dataset_layout import DATASET_EIT_FILE, DATASET_META_FILE, DATASET_QUANT_FILE
 
-def z_score(data, print_info: bool = True):
-    mean = np.mean(data)
-    std  = np.std(data)
+
+def z_score(data, print_info: bool = True, out=None, log=print):
+    """
+    Z-score data with its global mean/std. If given, out receives the result (out=data works in place).
+    float32 data stays float32; the statistics are accumulated in float64.
+    With print_info, the before/after statistics are passed to log (default: print).
+    """
+    data = np.asarray(data)
+    mean = float(data.mean(dtype=np.float64))
+
+    # Center first; the variance is then the sum of squares of the centered values, taken as float64
+    # dot products over blocks so float32 data needs no full-size float64 copy
+    data_z = np.subtract(data, mean, out=out)
+    flat = data_z.reshape(-1)
+    sq_sum = 0.0
+    for start in range(0, flat.size, 1 << 20):
+        block = flat[start:start + (1 << 20)].astype(np.float64, copy=False)
+        sq_sum += float(np.dot(block, block))
+    std = float(np.sqrt(sq_sum / flat.size)) if flat.size else float("nan")
 
     if print_info:
-        print(f"   before: mean={mean:.3f}, std={std:.3f}")
+        log(f"   before: mean={mean:.3f}, std={std:.3f}")
 
-    data_z = (data - mean) / std
+    data_z /= std
 
     if print_info:
-        print(f"   after:  mean={np.mean(data_z):.3f}, std={np.std(data_z):.3f}")
+        log(f"   after:  mean={np.mean(data_z):.3f}, std={np.std(data_z):.3f}")
 
     return data_z
 
 
+def read_quantization(quant_path: str):
+    """
+    Return (scale, offset) of the uint8 -> float mapping value = q * scale + offset stored at quant_path.
+    """
+    with open(quant_path, "r") as file:
+        quant = json.load(file)
+    return (quant["vmax"] - quant["vmin"]) / 255.0, quant["vmin"]
+
+
+def dequantize(data_q, quant_path: str, out=None, mean: float = 0.0, std: float = 1.0):
+    """
+    Map uint8 EIT magnitudes back to float32 using the vmin/vmax stored at quant_path.
+    If given, out (float32, same shape as data_q) receives the result. A mean/std is
+    folded into the same affine map, so the output is z-scored without extra passes.
+    """
+    scale, offset = read_quantization(quant_path)
+
+    if out is None:
+        out = np.empty(np.shape(data_q), dtype=np.float32)
+    np.multiply(data_q, np.float32(scale / std), out=out)
+    out += np.float32((offset - mean) / std)
+    return out
+
+
+def quantized_stats(data_q, quant_path: str):
+    """
+    Exact (count, mean, M2) of the dequantized values, from a 256-bin histogram of the uint8 data.
+    """
+    scale, offset = read_quantization(quant_path)
+    counts = np.bincount(np.ravel(data_q), minlength=256)
+    values = np.arange(counts.size) * scale + offset
+    count = int(counts.sum())
+    if count == 0:
+        return 0, 0.0, 0.0
+    mean = float(counts @ values) / count
+    return count, mean, float(counts @ (values - mean) ** 2)
+
+
+def has_legacy_samples(folder: str) -> bool:
+    """
+    True if folder holds sample*.npz files, the per-sample layout written before eit.npy/meta.npz.
+    """
+    if not os.path.isdir(folder):
+        return False
+    with os.scandir(folder) as entries:
+        return any(entry.name.startswith("sample") and entry.name.endswith(".npz") for entry in entries)
+
 
 def load_data(
     P_list: list,
     z_score_norm: str = "global", 
     path: str = None,
     print_info: bool = True,
+    max_workers: int = None,
 ):
     """
     Load EIT and torque data with optional normalization methods:
@@ -36,56 +102,95 @@ def load_data(
       - "global":           one global z-score over the entire X array (default)
       - "participant":      each participant's time series z-scored independently
       - "participant_meanfree": remove each participant's mean then global z-score
+    Participants are loaded in parallel by up to max_workers threads (default: ThreadPoolExecutor's).
     """
     if print_info:
         print("Loading participants:", P_list)
         print("Normalization method:", z_score_norm)
 
-    X, Y, P = [], [], []
-
-    for Ps in tqdm(P_list, total=len(P_list), desc="Loading data"):
-        Xs, Ys, Ps_list = [], [], []
+    # First pass: sample counts from the .npy headers, so X is allocated once at its final size
+    shapes = {}
+    for Ps in P_list:
         folder = join(path, Ps)
-        files  = sorted(glob(join(folder, "*.npz")))
-        if not files:
+        if not os.path.isfile(join(folder, DATASET_META_FILE)) and has_legacy_samples(folder):
+            raise ValueError(
+                f"{folder} holds per-sample sample*.npz files from an older dataset_creation; "
+                "regenerate it with save_eit_samples, which writes eit.npy/meta.npz/quantization.json"
+            )
+        shape = np.load(join(folder, DATASET_EIT_FILE), mmap_mode="r").shape if os.path.isfile(join(folder, DATASET_META_FILE)) else (0,)
+        if shape[0] == 0:  # no dataset, or one without samples
             print(f"⚠️  No files for {Ps} in {folder}")
             continue
+        shapes[Ps] = shape
+
+    n_total = sum(shape[0] for shape in shapes.values())
+    n_features = int(np.prod(next(iter(shapes.values()))[1:])) if shapes else 0
+    X = np.empty((n_total, n_features), dtype=np.float32)  # each sample flattened to 1D
+    Y = np.empty(n_total, dtype=np.float64)
+    P = np.repeat(np.array(list(shapes)), [shape[0] for shape in shapes.values()])
+
+    # For the global z-score, merge the per-participant statistics (Chan et al.) first, so that
+    # dequantization and normalization happen in the same pass below
+    mean, std = 0.0, 1.0
+    if z_score_norm == "global" and shapes:
+        def participant_stats(Ps):
+            folder = join(path, Ps)
+            return quantized_stats(np.load(join(folder, DATASET_EIT_FILE), mmap_mode="r"), join(folder, DATASET_QUANT_FILE))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            stats = list(executor.map(participant_stats, shapes))
 
-        for file in files:
-            data = np.load(file, allow_pickle=True)
-            Xs.append(np.abs(data["eit"]))
-            Ys.append(data["torque"])
-            Ps_list.append(Ps)
+        count, m2 = 0, 0.0
+        for n_s, mean_s, m2_s in stats:
+            if n_s == 0:
+                continue
+            delta = mean_s - mean
+            count += n_s
+            mean += delta * n_s / count
+            m2 += m2_s + delta**2 * (count - n_s) * n_s / count
+        std = np.sqrt(m2 / count) if count else 1.0
+
+        if print_info:
+            print("Applying GLOBAL z-score to entire dataset")
+            print(f"   before: mean={mean:.3f}, std={std:.3f}")
+
+    def load_participant(Ps, offset):
+        """Fill X/Y[offset:offset + n] for one participant; returns its messages for print_info."""
+        messages = []
+        folder = join(path, Ps)
+        n = shapes[Ps][0]
+        Xs = X[offset:offset + n]
+
+        # eit.npy / meta.npz / quantization.json as written by dataset_creation.save_eit_samples
+        eit_q = np.load(join(folder, DATASET_EIT_FILE), mmap_mode="r")
+        dequantize(eit_q.reshape(n, -1), join(folder, DATASET_QUANT_FILE), out=Xs, mean=mean, std=std)
+        with np.load(join(folder, DATASET_META_FILE)) as meta:
+            Y[offset:offset + n] = meta["torque"]
 
-        Xs = np.array(Xs)  # shape (n_samples, ...)
         # per-participant methods
         if z_score_norm == "participant":
-            if print_info: print(f"P{Ps}: participant z-scoring")
-            Xs = z_score(Xs, print_info)
+            if print_info: messages.append(f"P{Ps}: participant z-scoring")
+            z_score(Xs, print_info, out=Xs, log=messages.append)
         elif z_score_norm == "participant_meanfree":
-            if print_info: print(f"P{Ps}: mean-free → global z-scoring")
-            Xs_mean = np.mean(Xs, axis=0)
-            Xs      = z_score(Xs - Xs_mean, print_info)
-
-        # else: "none" or "global" → leave Xs raw for now
-
-        X.extend(Xs)
-        Y.extend(Ys)
-        P.extend(Ps_list)
-
-    X = np.array(X)
-    Y = np.array(Y)
-    P = np.array(P)
-
-    # flatten each sample to 1D
-    if X.ndim > 2:
-        n_samples = X.shape[0]
-        X = X.reshape(n_samples, -1)   # now (n_samples, 256*256)
-        
-    # global z-scoring, if requested
-    if z_score_norm == "global":
-        if print_info: print("Applying GLOBAL z-score to entire dataset")
-        X = z_score(X, print_info)
+            if print_info: messages.append(f"P{Ps}: mean-free → global z-scoring")
+            np.subtract(Xs, np.mean(Xs, axis=0), out=Xs)
+            z_score(Xs, print_info, out=Xs, log=messages.append)
+
+        # else: "none" → leave Xs raw, "global" → already z-scored by dequantize
+        return messages
+
+    # Participants fill disjoint slices of X/Y; np.load and the NumPy kernels release the GIL
+    offsets = np.concatenate(([0], np.cumsum([shape[0] for shape in shapes.values()])[:-1])).astype(int)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        messages = list(tqdm(executor.map(load_participant, shapes, offsets), total=len(shapes), desc="Loading data"))
+
+    # Printed here in participant order, since the worker threads would interleave them
+    for participant_messages in messages:
+        for message in participant_messages:
+            print(message)
+
+    if z_score_norm == "global" and print_info and X.size:
+        print(f"   after:  mean={np.mean(X):.3f}, std={np.std(X):.3f}")
 
     return X, Y, P
 
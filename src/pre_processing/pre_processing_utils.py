@@ -11,14 +11,28 @@ import os
 from os.path import join
 from glob import glob 
 import re
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import lru_cache
 from typing import Any, List, Tuple, Union, Dict, Optional
 
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from scipy.signal import butter, filtfilt, find_peaks, resample
+from scipy.signal import butter, sosfiltfilt, find_peaks, resample
 from toolbox import Protocol
+from pre_processing.time_utils import convert_timestamp
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:  # numba is optional; the kernels below fall back to NumPy
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """No-op stand-in for numba.njit when numba is not installed."""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
 
 
 def resample_signals(iso_iso, iso_py, target_length=None):
@@ -49,6 +63,15 @@ def detect_shift(signal1, signal2):
     print(f"Discrete time shift of {discrete_time_shift}.")
     return discrete_time_shift
 
+
+@lru_cache(maxsize=32)
+def _butter_sos(order: int, cutoff: float, fs: float) -> np.ndarray:
+    """Design (and cache) the low-pass Butterworth second-order sections for a given order, cutoff and fs."""
+    nyquist = 0.5 * fs
+    normal_cutoff = cutoff / nyquist
+    return butter(order, normal_cutoff, btype="low", analog=False, output="sos")
+
+
 def lowpass_filter(
     data: Union[np.ndarray, List[float]], cutoff: float = 2.0, fs: float = 100.0, order: int = 4
 ) -> np.ndarray:
@@ -71,10 +94,8 @@ def lowpass_filter(
     np.ndarray
         The filtered signal.
     """
-    nyquist = 0.5 * fs
-    normal_cutoff = cutoff / nyquist
-    b, a = butter(order, normal_cutoff, btype="low", analog=False)
-    filtered_signal = filtfilt(b, a, np.asarray(data))
+    sos = _butter_sos(order, cutoff, fs)
+    filtered_signal = sosfiltfilt(sos, np.asarray(data))
     return filtered_signal
 
 def scale_to_range(
@@ -99,14 +120,17 @@ def scale_to_range(
         The return type matches the input type.
     """
     values_arr = np.asarray(values)
-    old_min = np.min(values_arr)
-    old_max = np.max(values_arr)
+    old_min = values_arr.min()
+    old_max = values_arr.max()
 
     # Avoid division by zero if old_max equals old_min
     if old_max == old_min:
         scaled = np.full_like(values_arr, new_min)
     else:
-        scaled = new_min + (values_arr - old_min) * (new_max - new_min) / (old_max - old_min)
+        # One output buffer, updated in place: (x - old_min) * factor + new_min
+        scaled = np.subtract(values_arr, old_min, dtype=np.result_type(values_arr, 1.0))
+        scaled *= (new_max - new_min) / (old_max - old_min)
+        scaled += new_min
 
     # Return the same type as the input if possible.
     if isinstance(values, (list, tuple)):
@@ -114,6 +138,48 @@ def scale_to_range(
     return scaled
 
 
+def scale_to_unit_range_inplace(values: np.ndarray) -> np.ndarray:
+    """
+    Scale a floating-point array to [0, 1] in place.
+
+    Equivalent to scale_to_range(values) but without allocating a new array,
+    for buffers the caller owns.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Floating-point array to scale; it is modified in place.
+
+    Returns
+    -------
+    np.ndarray
+        The same array, scaled.
+    """
+    old_min = values.min()
+    old_max = values.max()
+    if old_max == old_min:
+        values.fill(0.0)
+    else:
+        values -= old_min
+        values *= 1.0 / (old_max - old_min)
+    return values
+
+
+@njit(cache=True)
+def _edges(signal: np.ndarray, threshold: float, rising: bool) -> np.ndarray:
+    """Single pass over the signal, returning indices where the step equals +/- threshold."""
+    out = np.empty(signal.size, dtype=np.int64)
+    n = 0
+    prev = signal[0]
+    for i in range(1, signal.size):
+        d = signal[i] - prev
+        if (rising and d == threshold) or ((not rising) and d == -threshold):
+            out[n] = i - 1
+            n += 1
+        prev = signal[i]
+    return out[:n]
+
+
 def edge_detection(signal: Union[np.ndarray, List[float]], mode: str = "rising", threshold: float = 1.0) -> np.ndarray:
     """
     Detect edges (rising or falling) in a signal based on a specified threshold.
@@ -133,45 +199,58 @@ def edge_detection(signal: Union[np.ndarray, List[float]], mode: str = "rising",
     np.ndarray
         The indices of the detected edges in the signal.
     """
-    signal = np.asarray(signal)
+    if mode not in ("rising", "falling"):
+        raise ValueError('mode must be either "rising" or "falling"')
+    signal = np.asarray(signal, dtype=np.float64)
+    if NUMBA_AVAILABLE and signal.size > 0:
+        return _edges(signal, float(threshold), mode == "rising")
+
     diff = np.diff(signal)
     if mode == "rising":
         edges = np.where(diff == threshold)[0]
-    elif mode == "falling":
-        edges = np.where(diff == -threshold)[0]
     else:
-        raise ValueError('mode must be either "rising" or "falling"')
+        edges = np.where(diff == -threshold)[0]
     return edges
 
-def convert_timestamp(date_str: Union[str, float]) -> Union[float, str]:
+
+def segment_window(n_samples: int, start_idxs: np.ndarray, stop_idxs: np.ndarray) -> np.ndarray:
     """
-    Convert a timestamp string to a UNIX timestamp or vice versa.
+    Build a binary mask that is 1 inside every [start, stop) segment and 0 elsewhere.
 
     Parameters
     ----------
-    date_str : str or float
-        The date string or UNIX timestamp.
+    n_samples : int
+        Length of the mask.
+    start_idxs : np.ndarray
+        Segment start indices.
+    stop_idxs : np.ndarray
+        Segment stop indices (exclusive).
 
     Returns
     -------
-    float or str
-        The converted timestamp.
+    np.ndarray
+        The mask as a float array of length n_samples.
     """
-    date_str = str(date_str)
-    if len(date_str.split(".")) > 2:
-        timestamp = datetime.strptime(date_str, "%Y.%m.%d. %H:%M:%S.%f")
-        return timestamp.timestamp()
-    else:
-        date_time = datetime.fromtimestamp(float(date_str))
-        return date_time.strftime("%Y.%m.%d. %H:%M:%S.%f")
-        
+    # +1 at every start, -1 at every stop; the running sum counts the segments covering each sample.
+    edges = np.zeros(n_samples + 1, dtype=np.int64)
+    np.add.at(edges, np.asarray(start_idxs, dtype=np.int64), 1)
+    np.add.at(edges, np.asarray(stop_idxs, dtype=np.int64), -1)
+    return (np.cumsum(edges[:-1]) > 0).astype(np.float64)
+
+# Raw ISO .txt column names mapped to the cleaned DataFrame column names
+ISO_RAW_COLUMNS = {
+    "Torque (or Velocity - ISOT, or Force - CKC)": "Torque",
+    "Angle (or Distance - CKC)": "Angle",
+    "Velocity (or Torque - ISOT, or Force - CKC)": "Velocity",
+}
+
 def generate_DF(file_path: str, output_path: str = None) -> pd.DataFrame:
     """
     Convert raw ISO data from a .txt file( which are messy) into a cleaned DataFrame and save it as a .csv file.
 
-    The function reads a tab-delimited file containing columns for torque, angle, and velocity,
-    cleans the data by replacing commas with periods and coercing numeric types, and then saves the cleaned
-    data to a CSV file.
+    The function reads only the torque, angle, and velocity columns of a tab-delimited file, parsing
+    the comma decimal separator directly in the CSV reader (pyarrow engine if available, C engine otherwise),
+    drops incomplete rows, and then saves the cleaned data to a CSV file.
 
     Parameters
     ----------
@@ -186,25 +265,18 @@ def generate_DF(file_path: str, output_path: str = None) -> pd.DataFrame:
         A cleaned DataFrame with columns "Torque", "Angle", and "Velocity".
     """
     iso_file_path = glob(join(file_path, "*.txt"))[0]
-    iso_data = pd.read_csv(iso_file_path, delimiter="\t", header=0)
+    read_kwargs = dict(sep="\t", header=0, decimal=",", usecols=list(ISO_RAW_COLUMNS))
+    try:
+        iso_data = pd.read_csv(iso_file_path, engine="pyarrow", **read_kwargs)
+    except (ImportError, ValueError):
+        # pyarrow is optional (and strict on malformed rows); the C engine handles both cases.
+        iso_data = pd.read_csv(iso_file_path, engine="c", **read_kwargs)
 
-    # Clean and convert the "Torque" column.
-    torque_str = iso_data["Torque (or Velocity - ISOT, or Force - CKC)"].str.replace(",", ".", regex=False)
-    torque_clean = pd.to_numeric(torque_str, errors="coerce").dropna()
+    # Clean columns are already float64; only columns with messy cells still need the string pass.
+    for column in iso_data.select_dtypes(exclude="number").columns:
+        iso_data[column] = pd.to_numeric(iso_data[column].str.replace(",", ".", regex=False), errors="coerce")
 
-    # Clean and convert the "Angle" column.
-    angle_str = iso_data["Angle (or Distance - CKC)"].str.replace(",", ".", regex=False)
-    angle_clean = pd.to_numeric(angle_str, errors="coerce").dropna()
-
-    # Clean and convert the "Velocity" column.
-    velocity_str = iso_data["Velocity (or Torque - ISOT, or Force - CKC)"].str.replace(",", ".", regex=False)
-    velocity_clean = pd.to_numeric(velocity_str, errors="coerce").dropna()
-
-    iso_raw_df = pd.DataFrame({
-        "Torque": torque_clean,
-        "Angle": angle_clean,
-        "Velocity": velocity_clean
-    })
+    iso_raw_df = iso_data.rename(columns=ISO_RAW_COLUMNS)[list(ISO_RAW_COLUMNS.values())].dropna()
 
     if output_path != None:
         iso_raw_df.to_csv(output_path, index=False)
@@ -274,17 +346,22 @@ class IsoForceRAW:
         or is less than the negative mean. Segments shorter than 1000 samples or longer than
         2500 samples are excluded.
         """
-        k = np.arange(len(self.speed))
-        dx_dk = np.gradient(self.speed, k)
-        self.start_idxs = np.where(dx_dk > np.mean(dx_dk))[0][1::2]
-        self.stop_idxs = np.where(dx_dk < -np.mean(dx_dk))[0][::2]
+        # Centered difference of the unit-spaced speed signal, i.e. 2 * np.gradient(speed).
+        # Only comparisons against the mean are used, so the factor 2 does not change the result.
+        speed = np.asarray(self.speed, dtype=np.float64)
+        dx_dk = np.empty_like(speed)
+        np.subtract(speed[2:], speed[:-2], out=dx_dk[1:-1])
+        dx_dk[0] = 2 * (speed[1] - speed[0])
+        dx_dk[-1] = 2 * (speed[-1] - speed[-2])
+        mean_dx_dk = dx_dk.mean()
+        self.start_idxs = np.where(dx_dk > mean_dx_dk)[0][1::2]
+        self.stop_idxs = np.where(dx_dk < -mean_dx_dk)[0][::2]
 
         # Exclude segments that are too short (<1000 samples) or too long (>2500 samples)
-        too_short = np.where(self.stop_idxs - self.start_idxs < 1000)[0]
-        too_long = np.where(self.stop_idxs - self.start_idxs > 2500)[0]
-        cut_out = np.concatenate([too_short, too_long])
-        self.start_idxs = np.delete(self.start_idxs, cut_out)
-        self.stop_idxs = np.delete(self.stop_idxs, cut_out)       
+        seg_len = self.stop_idxs - self.start_idxs
+        keep = (seg_len >= 1000) & (seg_len <= 2500)
+        self.start_idxs = self.start_idxs[keep]
+        self.stop_idxs = self.stop_idxs[keep]
 
 
     def export_segments(self) -> None:
@@ -294,16 +371,14 @@ class IsoForceRAW:
         The function creates dictionaries of torque and angle segments and also builds
         an exclusion window (a binary mask) over the full data length.
         """
-        T_segment_dict: Dict[str, np.ndarray] = {}
-        A_segment_dict: Dict[str, np.ndarray] = {}
-        exclude_window = np.zeros(len(self.speed))
-        for idx, (start, stop) in enumerate(zip(self.start_idxs, self.stop_idxs)):
-            T_segment_dict[f"T_seg_{idx}"] = self.torque[start:stop]
-            A_segment_dict[f"A_seg_{idx}"] = self.angle[start:stop]
-            exclude_window[start:stop] = 1
-        self.torque_segments = T_segment_dict
-        self.angle_segments = A_segment_dict
-        self.exclude_window = exclude_window
+        bounds = list(zip(self.start_idxs, self.stop_idxs))
+        self.torque_segments: Dict[str, np.ndarray] = {
+            f"T_seg_{idx}": self.torque[start:stop] for idx, (start, stop) in enumerate(bounds)
+        }
+        self.angle_segments: Dict[str, np.ndarray] = {
+            f"A_seg_{idx}": self.angle[start:stop] for idx, (start, stop) in enumerate(bounds)
+        }
+        self.exclude_window = segment_window(len(self.speed), self.start_idxs, self.stop_idxs)
 
     def filter_torque(self) -> None:
         """Apply the exclusion window to the torque signal."""
@@ -370,6 +445,9 @@ class IsoForceRAW:
 ###############################
 # Class for processing IsoData from NI chip
 
+# "_YYYY-MM-DD_HH-MM-SS_<sample number>.npz" suffix of the NI recording files
+NI_FILENAME_PATTERN = re.compile(r"_(\d{4})-(\d{2})-(\d{2})_(\d{2})-(\d{2})-(\d{2})_(\d+)\.npz$")
+
 def extract_timestamp_and_sample(filename: str) -> Tuple[Optional[datetime], Optional[int]]:
     """
     Extract a timestamp and sample number from the filename.
@@ -388,11 +466,11 @@ def extract_timestamp_and_sample(filename: str) -> Tuple[Optional[datetime], Opt
         A tuple (timestamp, sample_number) where timestamp is a datetime object and sample_number is an integer.
         Returns (None, None) if the filename does not match the expected format.
     """
-    match = re.search(r"_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})_(\d+)\.npz$", filename)
+    match = NI_FILENAME_PATTERN.search(filename)
     if match:
-        timestamp_str = match.group(1)
-        sample_number = int(match.group(2))
-        timestamp = datetime.strptime(timestamp_str, "%Y-%m-%d_%H-%M-%S")
+        # Build the datetime from the matched fields directly; strptime is slow in a sort key.
+        timestamp = datetime(*map(int, match.group(1, 2, 3, 4, 5, 6)))
+        sample_number = int(match.group(7))
         return timestamp, sample_number
     return None, None
 
@@ -454,51 +532,43 @@ class IsoForcePy:
 
     def init_data(self) -> None:
         """Load and aggregate data from .npz files in the given directory."""
-        angle: List[float] = []   # Channel 1
-        torque: List[float] = []  # Channel 2
-        speed: List[float] = []   # Channel 3
-        timestamps_list: List[datetime] = []
-        timestmp_current : List[datetime] = []
-
-        file_list = sorted(
-            [f for f in os.listdir(self.path) if f.endswith(".npz")],
-            key=lambda f: extract_timestamp_and_sample(f),
-        )
+        channel_blocks: List[np.ndarray] = []  # (3, n_samples) per file: angle, torque, speed
+        timestamps_list: List[np.ndarray] = []
+
+        # Parse each filename once and sort on the precomputed (timestamp, sample_number) keys.
+        with os.scandir(self.path) as it:
+            entries = [
+                (extract_timestamp_and_sample(entry.name), entry.name)
+                for entry in it
+                if entry.name.endswith(".npz")
+            ]
+        entries = [(key, name) for key, name in entries if key[0] is not None]
+        entries.sort(key=lambda entry: entry[0])
 
-        # Keep only the last file for each unique timestamp.
-        last_file_for_timestamp: Dict[datetime, str] = {}
-        for file_name in file_list:
-            timestamp, sample_number = extract_timestamp_and_sample(file_name)
-            if timestamp is not None:
-                last_file_for_timestamp[timestamp] = file_name
+        # Keep only the last file for each unique timestamp (highest sample number wins).
+        last_file_for_timestamp: Dict[datetime, str] = {
+            timestamp: file_name for (timestamp, _), file_name in entries
+        }
 
         for timestamp, last_file in last_file_for_timestamp.items():
             file_path = os.path.join(self.path, last_file)
-            data = np.load(file_path, allow_pickle=True)
-            ch_1, ch_2, ch_3 = data["data"]
-            assert len(ch_1) == len(ch_2) == len(ch_3), "Channel lengths do not match."
-
-            sampling_rate = data["sampling_rate"]
-            time_current = data["timestamps_current"]
-            # Expand timestamps for each sample.
-            timestamps_expanded = [
-                timestamp + timedelta(seconds=(i / sampling_rate)) for i in range(len(ch_1))
-            ]
+            with np.load(file_path) as data:
+                block = np.asarray(data["data"], dtype=np.float64)
+                sampling_rate = data["sampling_rate"]
+            assert block.ndim == 2 and block.shape[0] == 3, "Channel lengths do not match."
 
-            angle.extend(ch_1)
-            torque.extend(ch_2)
-            speed.extend(ch_3)
-            timestamps_list.extend(timestamps_expanded)
-            timestmp_current.extend(time_current)
+            # Expand timestamps for each sample (microsecond offsets from the file timestamp).
+            offsets_us = np.round(np.arange(block.shape[1]) * (1e6 / float(sampling_rate))).astype(np.int64)
+            timestamps_expanded = np.datetime64(timestamp, "us") + offsets_us.astype("timedelta64[us]")
 
-        if self.Leg == "right":
-            self.angle = np.array(angle)
-            self.torque_raw = np.array(torque)
-            self.speed = np.array(speed)
-        else:
-            self.angle = -1 * np.array(angle)
-            self.torque_raw = -1 * np.array(torque)
-            self.speed = -1 * np.array(speed)
+            channel_blocks.append(block)
+            timestamps_list.append(timestamps_expanded)
+
+        # Single contiguous copy of all files instead of growing per-sample Python lists.
+        channels = np.concatenate(channel_blocks, axis=1)
+        if self.Leg != "right":
+            np.negative(channels, out=channels)
+        self.angle, self.torque_raw, self.speed = channels
 
 
         if self.LP_filter_enabled:
@@ -508,26 +578,25 @@ class IsoForcePy:
             self.torque = self.torque_raw
 
         if self.scale_0_1:
-            self.angle = scale_to_range(self.angle)
-            self.torque = scale_to_range(self.torque)
-            self.torque_raw = scale_to_range(self.torque_raw)
-            self.speed = scale_to_range(self.speed)
+            # All channels are float64 buffers owned by this instance, so rescale them in place.
+            # Without the low-pass filter torque and torque_raw are the same array: scale it once.
+            for channel in (self.angle, self.torque_raw, self.speed):
+                scale_to_unit_range_inplace(channel)
+            if self.torque is not self.torque_raw:
+                scale_to_unit_range_inplace(self.torque)
 
         if self.speed_window_trunc:
-            speed_window = np.copy(self.speed)
-            # Create a binary mask: set values to 1 if above a threshold, else 0.
-            speed_window[speed_window <= 0.90] = 0
-            speed_window[speed_window > 0.5] = 1
-
-            # Add a few zeros at the beginning
-            num_zeros = 10  
-            speed_window = np.concatenate((np.zeros(num_zeros), speed_window))
+            # Binary mask (1 where the speed is above the threshold, else 0),
+            # preceded by a few zeros, written into a fresh buffer so self.speed is untouched.
+            num_zeros = 10
+            speed_window = np.zeros(num_zeros + len(self.speed))
+            np.greater(self.speed, 0.90, out=speed_window[num_zeros:])
             self.speed_window = speed_window
 
         if self.over_UTC:
-            self.time = np.array(timestamps_list)
+            self.time = np.concatenate(timestamps_list)
         else:
-            self.time = np.arange(len(timestamps_list))
+            self.time = np.arange(sum(len(ts) for ts in timestamps_list))
         
         #self.timestamps = np.array([dt.timestamp() for dt in self.time])
 
@@ -546,9 +615,6 @@ class IsoForcePy:
         height : float, optional
             Minimum height of peaks (default is 0.7).
         """
-        T_segment_dict: Dict[str, np.ndarray] = {}
-        A_segment_dict: Dict[str, np.ndarray] = {}
-
         self.stop_idxs, _ = find_peaks(self.angle, distance=distance, height=height) # for tst remove 1 element
         #self.stop_idxs = self.stop_idxs[1:]  # -> for those that we dont have the first segment
         ##########
@@ -562,16 +628,12 @@ class IsoForcePy:
 
         # Filtered start indices
         start_detected = start_detected[valid_indices]
-        start_filt = []
-        for stop in self.stop_idxs:
-            diff = stop - start_detected
-            positive_diffs = diff[diff > 0]
-            if positive_diffs.size == 0:
-                continue
-            min_diff_idx = np.argmin(positive_diffs)
-            start_filt.append(start_detected[diff > 0][min_diff_idx])
 
-        self.start_idxs = np.array(start_filt) - self.phase_shift
+        # For each stop pick the closest preceding start (start_detected is sorted);
+        # stops without any preceding start are dropped.
+        self.stop_idxs = self.stop_idxs[self.stop_idxs > start_detected[0]]
+        nearest_start = np.searchsorted(start_detected, self.stop_idxs, side="left") - 1
+        self.start_idxs = start_detected[nearest_start] - self.phase_shift
 
         # Exclude segments shorter than 300 samples (~3 seconds at fs=300).
         valid_mask = (self.stop_idxs - self.start_idxs) > self.segment_len_threshold
@@ -580,15 +642,14 @@ class IsoForcePy:
 
         assert self.start_idxs.shape == self.stop_idxs.shape, "start_idxs and stop_idxs do not match."
 
-        exclude_window = np.zeros(len(self.torque))
-        for idx, (start, stop) in enumerate(zip(self.start_idxs, self.stop_idxs)):
-            T_segment_dict[f"T_seg_{idx}"] = self.torque[start:stop]
-            A_segment_dict[f"A_seg_{idx}"] = self.angle[start:stop]
-            exclude_window[start:stop] = 1
-
-        self.torque_segments = T_segment_dict
-        self.angle_segments = A_segment_dict
-        self.exclude_window = exclude_window   
+        bounds = list(zip(self.start_idxs, self.stop_idxs))
+        self.torque_segments: Dict[str, np.ndarray] = {
+            f"T_seg_{idx}": self.torque[start:stop] for idx, (start, stop) in enumerate(bounds)
+        }
+        self.angle_segments: Dict[str, np.ndarray] = {
+            f"A_seg_{idx}": self.angle[start:stop] for idx, (start, stop) in enumerate(bounds)
+        }
+        self.exclude_window = segment_window(len(self.torque), self.start_idxs, self.stop_idxs)
    
         
     def filter_torque(self) -> None:
@@ -1,16 +1,26 @@
 import os
+import json
+import math
 import logging
 from typing import Dict, List, Tuple
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from glob import glob
 from tqdm import tqdm
 from dtaidistance import dtw
+from dtaidistance.exceptions import CythonException
 import matplotlib.pyplot as plt
 
-from toolbox import Protocol
-from pre_processing.pre_processing_utils import IsoForceRAW, IsoForcePy
+from toolbox import load_protocol
+from pre_processing.pre_processing_utils import IsoForceRAW, IsoForcePy, NUMBA_AVAILABLE, njit
 from pre_processing.eit_utils import load_eit_npz
+from pre_processing.dataset_layout import DATASET_EIT_FILE, DATASET_META_FILE, DATASET_QUANT_FILE
+
+try:
+    from numba import cuda
+except ImportError:  # numba is optional; find_best_dtw_match_cuda then falls back to find_best_dtw_match
+    cuda = None
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +34,47 @@ def find_nearest_index(array: np.ndarray, value: float) -> int:
     return idx
 
 
+def find_nearest_indices(sorted_array: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Vectorized find_nearest_index for an ascending 'sorted_array': binary search, then
+    compare with the left neighbour (ties go to the lower index, as with argmin).
+    """
+    sorted_array = np.asarray(sorted_array)
+    values = np.asarray(values)
+    if len(sorted_array) < 2:
+        return np.zeros(values.shape, dtype=np.intp)
+    pos = np.clip(np.searchsorted(sorted_array, values), 1, len(sorted_array) - 1)
+    left = sorted_array[pos - 1]
+    right = sorted_array[pos]
+    return pos - (np.abs(values - left) <= np.abs(values - right))
+
+
+@njit(cache=True)
+def _dtw_2row(a: np.ndarray, b: np.ndarray) -> float:
+    """DTW distance (as dtaidistance's dtw.distance) keeping only the previous and current DP row."""
+    prev = np.full(b.size + 1, np.inf)
+    curr = np.empty(b.size + 1)
+    prev[0] = 0.0
+    for i in range(a.size):
+        curr[0] = np.inf
+        for j in range(b.size):
+            d = a[i] - b[j]
+            curr[j + 1] = d * d + min(prev[j + 1], curr[j], prev[j])
+        prev, curr = curr, prev
+    return np.sqrt(prev[b.size])
+
+
+@njit(cache=True)
+def _best_dtw_window(long_series: np.ndarray, reference_series: np.ndarray, window_size: int) -> Tuple[int, float]:
+    """Compiled sliding-window scan of find_best_dtw_match."""
+    best_idx, best_dist = 0, np.inf
+    for i in range(long_series.size - window_size + 1):
+        dist = _dtw_2row(reference_series, long_series[i:i + window_size])
+        if dist < best_dist:
+            best_idx, best_dist = i, dist
+    return best_idx, best_dist
+
+
 def find_best_dtw_match(
     long_series: np.ndarray,
     reference_series: np.ndarray,
@@ -35,33 +86,122 @@ def find_best_dtw_match(
 
     Returns (best_start_index, best_distance).
     """
-    best_idx = 0
-    best_dist = float('inf')
-    for i in range(len(long_series) - window_size + 1):
-        segment = long_series[i:i+window_size]
-        dist = dtw.distance(reference_series, segment)
-        if dist < best_dist:
-            best_dist = dist
-            best_idx = i
+    long_series = np.asarray(long_series, dtype=np.double)
+    if len(long_series) < window_size:
+        return 0, float('inf')
+
+    if NUMBA_AVAILABLE:
+        best_idx, best_dist = _best_dtw_window(long_series, np.asarray(reference_series, dtype=np.double), window_size)
+        logger.info("Best DTW match at %d (distance=%.3f)", best_idx, best_dist)
+        return int(best_idx), float(best_dist)
+
+    # All windows in one serial C call: row 0 (reference) of the distance matrix against every window.
+    # Without dtaidistance's C library, score the windows one by one with the pure-Python dtw.distance.
+    reference_series = np.asarray(reference_series, dtype=np.double)
+    windows = np.ascontiguousarray(sliding_window_view(long_series, window_size))
+    try:
+        series = [reference_series, *windows]
+        dists = np.asarray(
+            dtw.distance_matrix_fast(series, block=((0, 1), (1, len(series))), compact=True, parallel=False)
+        )
+    except CythonException:
+        dists = np.array([dtw.distance(reference_series, window) for window in windows])
+
+    best_idx = int(np.argmin(dists))
+    best_dist = float(dists[best_idx])
     logger.info("Best DTW match at %d (distance=%.3f)", best_idx, best_dist)
     return best_idx, best_dist
 
 
-def sync_NI_PY_times(
-    isoforce_iso: IsoForceRAW,
-    isoforce_py: IsoForcePy,
+# Longest DTW window the GPU kernel handles; its DP rows live in fixed-size per-thread local arrays
+CUDA_DTW_MAX_WINDOW = 64
+
+if cuda is not None:
+    @cuda.jit
+    def _dtw_windows_kernel(long_series, reference_series, window_size, out):
+        """One GPU thread per candidate start: two-row DTW (as _dtw_2row) of reference vs. its window."""
+        i = cuda.grid(1)
+        if i >= out.size:
+            return
+        prev = cuda.local.array(CUDA_DTW_MAX_WINDOW + 1, np.float64)
+        curr = cuda.local.array(CUDA_DTW_MAX_WINDOW + 1, np.float64)
+        prev[0] = 0.0
+        for j in range(1, window_size + 1):
+            prev[j] = math.inf
+        for r in range(reference_series.size):
+            curr[0] = math.inf
+            for j in range(window_size):
+                d = reference_series[r] - long_series[i + j]
+                curr[j + 1] = d * d + min(prev[j + 1], curr[j], prev[j])
+            for j in range(window_size + 1):
+                prev[j] = curr[j]
+        out[i] = math.sqrt(prev[window_size])
+
+
+def find_best_dtw_match_cuda(
+    long_series: np.ndarray,
+    reference_series: np.ndarray,
+    window_size: int = 4
+) -> Tuple[int, float]:
+    """
+    GPU version of find_best_dtw_match: every window of 'long_series' is scored in its own CUDA thread.
+
+    Falls back to find_best_dtw_match when numba's CUDA target is unavailable or 'window_size'
+    exceeds CUDA_DTW_MAX_WINDOW. Worth it for long series; short ones are dominated by the transfers.
+
+    Returns (best_start_index, best_distance).
+    """
+    if cuda is None or not cuda.is_available() or window_size > CUDA_DTW_MAX_WINDOW:
+        return find_best_dtw_match(long_series, reference_series, window_size)
+
+    long_series = np.asarray(long_series, dtype=np.double)
+    if len(long_series) < window_size:
+        return 0, float('inf')
+
+    n_windows = len(long_series) - window_size + 1
+    dists = cuda.device_array(n_windows, dtype=np.float64)
+    threads_per_block = 128
+    _dtw_windows_kernel[(n_windows + threads_per_block - 1) // threads_per_block, threads_per_block](
+        cuda.to_device(long_series),
+        cuda.to_device(np.asarray(reference_series, dtype=np.double)),
+        window_size,
+        dists
+    )
+    dists = dists.copy_to_host()
+
+    best_idx = int(np.argmin(dists))
+    best_dist = float(dists[best_idx])
+    logger.info("Best DTW match at %d (distance=%.3f)", best_idx, best_dist)
+    return best_idx, best_dist
+
+
+def plot_segment_alignment(ax, raw_seg: np.ndarray, py_seg: np.ndarray, seg_idx: int) -> None:
+    """
+    Draw raw IsoForce torque, scaled Python torque and the uniformly sampled points of one segment on 'ax'.
+    """
+    indices = np.linspace(0, len(raw_seg) - 1, len(py_seg), dtype=int)
+    ax.set_title(f"Segment {seg_idx} alignment")
+    ax.plot(raw_seg, label="Raw IsoForce")
+    ax.plot(indices, py_seg * 60, '--', label="Python IsoForce")
+    ax.scatter(indices, raw_seg[indices], c='red', marker='x', label="Sampled")
+    ax.set_ylabel("Torque (Nm)")
+    ax.set_xlabel("Sample index")
+    ax.legend()
+    ax.grid(True)
+
+
+def sample_raw_segment(
+    raw_seg: np.ndarray,
+    py_seg: np.ndarray,
+    ts_seg: np.ndarray,
     seg_idx: int = 0,
     plotting: bool = False
 ) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Align torque segments from IsoForceRAW and IsoForcePy by matching lengths.
+    Uniformly sample one raw IsoForce torque segment onto the timestamps of its IsoForcePy segment.
 
     Returns (timestamps_iso, sampled_iso_torque).
     """
-    raw_seg = isoforce_iso.torque_segments[f"T_seg_{seg_idx}"]
-    py_seg = isoforce_py.torque_segments[f"T_seg_{seg_idx}"]
-    ts_seg = isoforce_py.timestamps_segments[f"TS_seg_{seg_idx}"]
-
     if len(py_seg) != len(ts_seg):
         logger.error("Length mismatch: py_seg (%d) vs ts_seg (%d)", len(py_seg), len(ts_seg))
         raise ValueError("IsoForcePY segments and timestamps length mismatch")
@@ -71,26 +211,83 @@ def sync_NI_PY_times(
     sampled_raw = raw_seg[indices]
 
     if plotting:
-        plt.figure(figsize=(6, 2))
-        plt.title(f"Segment {seg_idx} alignment")
-        plt.plot(raw_seg, label="Raw IsoForce")
-        plt.plot(indices, py_seg * 60, '--', label="Python IsoForce")
-        plt.scatter(indices, sampled_raw, c='red', marker='x', label="Sampled")
-        plt.ylabel("Torque (Nm)")
-        plt.xlabel("Sample index")
-        plt.legend()
-        plt.grid(True)
+        _, ax = plt.subplots(figsize=(6, 2))
+        plot_segment_alignment(ax, raw_seg, py_seg, seg_idx)
         plt.show()
 
     return ts_seg, sampled_raw
 
 
+def sync_NI_PY_times(
+    isoforce_iso: IsoForceRAW,
+    isoforce_py: IsoForcePy,
+    seg_idx: int = 0,
+    plotting: bool = False
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Align torque segments from IsoForceRAW and IsoForcePy by matching lengths.
+
+    Returns (timestamps_iso, sampled_iso_torque).
+    """
+    return sample_raw_segment(
+        isoforce_iso.torque_segments[f"T_seg_{seg_idx}"],
+        isoforce_py.torque_segments[f"T_seg_{seg_idx}"],
+        isoforce_py.timestamps_segments[f"TS_seg_{seg_idx}"],
+        seg_idx,
+        plotting
+    )
+
+
+def _export_dataset(export_dir: str, eit: np.ndarray, **meta: np.ndarray) -> None:
+    """
+    Write synced samples as eit.npy (uint8 EIT magnitudes quantized between their 0.1 and 99.9
+    percentiles), quantization.json (that range) and meta.npz (the per-sample 'meta' arrays).
+    """
+    os.makedirs(export_dir, exist_ok=True)
+    eit_abs = np.abs(eit)
+    vmin, vmax = np.percentile(eit_abs, [0.1, 99.9]) if eit_abs.size else (0.0, 0.0)
+    quant_scale = 255.0 / (vmax - vmin) if vmax > vmin else 0.0
+
+    np.save(os.path.join(export_dir, DATASET_EIT_FILE), np.clip((eit_abs - vmin) * quant_scale + 0.5, 0, 255).astype(np.uint8))
+    np.savez(os.path.join(export_dir, DATASET_META_FILE), **meta)
+    with open(os.path.join(export_dir, DATASET_QUANT_FILE), "w") as file:
+        json.dump({"vmin": float(vmin), "vmax": float(vmax)}, file)
+
+
+def _process_segment(
+    idx: int,
+    raw_seg: np.ndarray,
+    py_seg: np.ndarray,
+    ts_seg: np.ndarray,
+    eit_timestamps: np.ndarray,
+    mode: str
+) -> Tuple[np.ndarray, np.ndarray, float, float]:
+    """
+    Find the EIT frames of one torque segment.
+
+    Returns (sync_idx, sampled_iso_torque, dt_start, dt_end).
+    """
+    ts_seg, sampled = sample_raw_segment(raw_seg, py_seg, ts_seg, idx)
+
+    if mode == "fast":
+        sync_idx = find_nearest_indices(eit_timestamps, ts_seg)
+    else:
+        start, _ = find_best_dtw_match(eit_timestamps, ts_seg[:5])
+        sync_idx = list(range(start, start + len(ts_seg)))
+
+    # time-diff checks
+    dt_start = ts_seg[0] - eit_timestamps[sync_idx[0]]
+    dt_end = ts_seg[-1] - eit_timestamps[sync_idx[-1]]
+    return sync_idx, sampled, dt_start, dt_end
+
+
 def synchronize_eit_force_data(
     eit_path: str,
     isoforce_iso: IsoForceRAW,
     isoforce_py: IsoForcePy,
     mode: str = "fast",
-    export_dir: str = None
+    export_dir: str = None,
+    debug_plot: bool = False
 ) -> Dict[str, np.ndarray]:
     """
     Synchronize EIT frames with isokinetic torque measurements.
@@ -100,67 +297,85 @@ def synchronize_eit_force_data(
         isoforce_iso: Raw IsoForce data object.
         isoforce_py: Processed IsoForce data object.
         mode: 'fast' uses nearest-timestamp; 'slow' uses DTW on initial window.
-        export_dir: If provided, save each synced sample as .npz files.
+        export_dir: If provided, save the synced samples there in the layout of
+            dataset_creation.save_eit_samples (eit.npy, meta.npz, quantization.json), readable by
+            normalization_utils.load_data; meta.npz also maps every sample to its (segment, offset).
+        debug_plot: If True, show the alignment of all synced segments in one figure at the end.
 
     Returns:
         Dict with keys 'eit', 'torque', 'ts_iso', 'ts_eit' containing concatenated arrays.
     """
-    protocol = Protocol(eit_path, verbose=False)
+    protocol = load_protocol(eit_path)
     force_levels = protocol.IsokineticMeasurement.force_levels
 
     # load EIT data
     eit_timestamps, eit_data = load_eit_npz(eit_path)
 
-    all_eit = []
-    all_torque = []
-    all_ts_iso = []
-    all_ts_eit = []
-    sample_counter = 0
+    # (raw torque, python torque, python timestamps) of every segment, looked up once
+    segments = [
+        (
+            isoforce_iso.torque_segments[f"T_seg_{i}"],
+            isoforce_py.torque_segments[f"T_seg_{i}"],
+            isoforce_py.timestamps_segments[f"TS_seg_{i}"],
+        )
+        for i in range(len(isoforce_iso.torque_segments))
+    ]
 
-    for idx in range(len(isoforce_iso.torque_segments)):
-        ts_seg, sampled = sync_NI_PY_times(isoforce_iso, isoforce_py, idx, plotting=True)
+    # Pre-size the outputs for all segments (skipped segments leave the tail unused) instead of
+    # collecting per-segment arrays and concatenating them at the end
+    total = sum(len(ts_seg) for _, _, ts_seg in segments)
+    out_eit = np.empty((total, *eit_data.shape[1:]), dtype=eit_data.dtype)
+    out_torque = np.empty(total, dtype=np.result_type(*(raw for raw, _, _ in segments)) if segments else np.float64)
+    out_ts_iso = np.empty(total, dtype=np.result_type(*(ts for _, _, ts in segments)) if segments else np.float64)
+    out_ts_eit = np.empty(total, dtype=eit_timestamps.dtype)
+    offset = 0
 
-        if mode == "fast":
-            sync_idx = [find_nearest_index(eit_timestamps, t) for t in ts_seg]
-        else:
-            start, _ = find_best_dtw_match(eit_timestamps, ts_seg[:5])
-            sync_idx = list(range(start, start + len(ts_seg)))
+    synced_segments = []
+    segment_lengths = []
 
-        # time-diff checks
-        dt_start = ts_seg[0] - eit_timestamps[sync_idx[0]]
-        dt_end = ts_seg[-1] - eit_timestamps[sync_idx[-1]]
+    for idx, (raw_seg, py_seg, ts_seg) in enumerate(segments):
+        sync_idx, sampled, dt_start, dt_end = _process_segment(idx, raw_seg, py_seg, ts_seg, eit_timestamps, mode)
         if abs(dt_start) > 5 or abs(dt_end) > 5:
             logger.warning("Skipping segment %d: time mismatch [%.2f, %.2f]", idx, dt_start, dt_end)
             continue
 
-        segment_eit = eit_data[sync_idx]
-        segment_torque = sampled
-        segment_ts_eit = eit_timestamps[sync_idx]
-
-        all_eit.append(segment_eit)
-        all_torque.append(segment_torque)
-        all_ts_iso.append(ts_seg)
-        all_ts_eit.append(segment_ts_eit)
-
-        if export_dir:
-            os.makedirs(export_dir, exist_ok=True)
-            for i, (e, tq, t_iso, t_eit) in enumerate(zip(segment_eit, sampled, ts_seg, segment_ts_eit)):
-                filename = os.path.join(export_dir, f"sample_{sample_counter:05d}.npz")
-                np.savez(
-                    filename,
-                    eit=e,
-                    torque=tq,
-                    ts_iso=t_iso,
-                    ts_eit=t_eit,
-                    target_force=force_levels[idx],
-                    participant=protocol.Participant.Number
-                )
-                sample_counter += 1
+        n = len(ts_seg)
+        # eit_data is memory-mapped; taking the synced frames reads only those into memory
+        np.take(eit_data, sync_idx, axis=0, out=out_eit[offset:offset + n])
+        np.take(eit_timestamps, sync_idx, out=out_ts_eit[offset:offset + n])
+        out_torque[offset:offset + n] = sampled
+        out_ts_iso[offset:offset + n] = ts_seg
+        offset += n
+        synced_segments.append(idx)
+        segment_lengths.append(n)
+
+    if export_dir:
+        lengths = np.asarray(segment_lengths, dtype=int)
+        segment = np.repeat(np.asarray(synced_segments, dtype=int), lengths)
+        _export_dataset(
+            export_dir,
+            out_eit[:offset],
+            torque=out_torque[:offset],
+            target_force=np.asarray(force_levels)[segment],
+            participant=np.full(offset, protocol.Participant.Number),
+            timestamps=out_ts_eit[:offset],
+            ts_iso=out_ts_iso[:offset],
+            segment=segment,
+            offset=np.arange(offset) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        )
+
+    if debug_plot and synced_segments:
+        fig, axes = plt.subplots(len(synced_segments), 1, figsize=(6, 2 * len(synced_segments)), squeeze=False)
+        for ax, idx in zip(axes[:, 0], synced_segments):
+            raw_seg, py_seg, _ = segments[idx]
+            plot_segment_alignment(ax, raw_seg, py_seg, idx)
+        fig.tight_layout()
+        plt.show()
 
     result = {
-        'eit': np.concatenate(all_eit),
-        'torque': np.concatenate(all_torque),
-        'ts_iso': np.concatenate(all_ts_iso),
-        'ts_eit': np.concatenate(all_ts_eit),
+        'eit': out_eit[:offset],
+        'torque': out_torque[:offset],
+        'ts_iso': out_ts_iso[:offset],
+        'ts_eit': out_ts_eit[:offset],
     }
     return result
@@ -0,0 +1,43 @@
+"""
+time_utils.py
+-------------
+
+Timestamp helpers shared by eit_utils and pre_processing_utils. This module has no project
+imports, so it can be imported with either the repository root or src/ on the path.
+"""
+
+import re
+from datetime import datetime
+
+# "YYYY.MM.DD. HH:MM:SS.FFF" date_time header of .eit files
+EIT_DATE_PATTERN = re.compile(r"(\d{4})\.(\d{1,2})\.(\d{1,2})\. (\d{1,2}):(\d{1,2}):(\d{1,2})\.(\d{1,6})")
+
+
+def convert_timestamp(date_str: str):
+    """
+    Converts date string to a timestamp, or a UNIX timestamp back to a date string.
+
+    Parameters
+    ----------
+    date_str : str or float
+        Date in the format "YYYY.MM.DD. HH:MM:SS.FFF", or a UNIX timestamp
+
+    Returns
+    -------
+    float or str
+        Converted timestamp or formatted datetime string
+    """
+    date_str = str(date_str)
+    try:
+        if len(date_str.split(".")) > 2:
+            match = EIT_DATE_PATTERN.fullmatch(date_str)
+            if match is None:
+                return datetime.strptime(date_str, "%Y.%m.%d. %H:%M:%S.%f").timestamp()
+            # Same result as strptime with "%Y.%m.%d. %H:%M:%S.%f", without its format interpreter
+            *fields, fraction = match.groups()
+            return datetime(*map(int, fields), int(fraction.ljust(6, "0"))).timestamp()
+        else:
+            return datetime.fromtimestamp(float(date_str)).strftime("%Y.%m.%d. %H:%M:%S.%f")
+    except Exception as e:
+        print(f"Error converting timestamp: {e}")
+        return date_str
@@ -5,6 +5,6 @@ This allows importing toolbox utilities from the main project directory.
 """
 
 
-from .protocol_handler import Protocol, Participant, IsokineticMeasurement, EITMeasurement
+from .protocol_handler import Protocol, Participant, IsokineticMeasurement, EITMeasurement, load_protocol
 
-__all__ = ["Protocol", "Participant", "IsokineticMeasurement", "EITMeasurement"]
+__all__ = ["Protocol", "Participant", "IsokineticMeasurement", "EITMeasurement", "load_protocol"]
@@ -1,9 +1,12 @@
-import matplotlib.colors as mcolors
-import matplotlib.pyplot as plt
 import numpy as np
 from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
-from sklearn.preprocessing import StandardScaler, MinMaxScaler, normalize
+
+try:
+    from openTSNE import TSNE as OpenTSNE
+    OPENTSNE_AVAILABLE = True
+except ImportError:
+    OPENTSNE_AVAILABLE = False
 
 
 
@@ -24,15 +27,30 @@ def _apply_normalization(
     if method is None:
         return X
     m = method.lower()
+    if m not in ("zscore", "minmax", "l2"):
+        raise ValueError(f"Unknown normalization method: {method!r}")
+
+    # Same results as StandardScaler / MinMaxScaler / normalize, without the estimator overhead;
+    # float32 input stays float32, constant features (or all-zero rows for l2) are left unscaled
+    X = np.asarray(X)
+    if not np.issubdtype(X.dtype, np.floating):
+        X = X.astype(np.float64)
     if m == "zscore":
-        scaler = StandardScaler()
-        return scaler.fit_transform(X)
-    if m == "minmax":
-        scaler = MinMaxScaler()
-        return scaler.fit_transform(X)
-    if m == "l2":
-        return normalize(X, norm="l2")
-    raise ValueError(f"Unknown normalization method: {method!r}")
+        # statistics accumulated in float64, as sklearn does
+        scale = X.std(axis=0, dtype=np.float64).astype(X.dtype)
+        scale[scale == 0] = 1.0
+        out = X - X.mean(axis=0, dtype=np.float64).astype(X.dtype)
+    elif m == "minmax":
+        x_min = X.min(axis=0)
+        scale = X.max(axis=0) - x_min
+        scale[scale == 0] = 1.0
+        out = X - x_min
+    else:
+        scale = np.sqrt(np.einsum("ij,ij->i", X, X))[:, np.newaxis]
+        scale[scale == 0] = 1.0
+        out = X.copy()
+    out /= scale
+    return out
 
 def compute_PCA(
     signal: np.ndarray,
@@ -59,10 +77,17 @@ def compute_PCA(
     # Normalize features if requested
     X = _apply_normalization(signal, normalization)
 
-    pca = PCA(n_components=n_cmp)
+    # svd_solver="auto" already picks covariance_eigh for tall data (many frames, few features) and
+    # randomized SVD for wide data; random_state makes the latter reproducible. A normalized X is a
+    # private copy, so PCA may center it in place.
+    pca = PCA(n_components=n_cmp, random_state=0, copy=X is signal)
     P = pca.fit_transform(X)
 
     if plot:
+        # matplotlib is only imported when plotting, so embedding-only (headless) callers skip its import cost
+        import matplotlib.colors as mcolors
+        import matplotlib.pyplot as plt
+
         if n_cmp == 2:
             plt.figure(figsize=(8, 6))
             if feature is None:
@@ -102,6 +127,7 @@ def compute_TSNE(
     feature_label: str = "Feature",
     normalization: str = None,
     plot: bool = True,
+    backend: str = "sklearn",
     **tsne_kwargs
 ) -> np.ndarray:
     """
@@ -113,22 +139,37 @@ def compute_TSNE(
         feature_label (str): Label for color bar. Defaults to "Feature".
         normalization (str, optional): "zscore", "minmax", or None. Defaults to None.
         plot (bool): Whether to display the scatter plot. Defaults to True.
-        **tsne_kwargs: Additional args for sklearn.manifold.TSNE.
+        backend (str): "sklearn", "opentsne" (multithreaded FFT-accelerated t-SNE; embedding and
+            accepted kwargs differ from sklearn's), or "auto" to use openTSNE when it is installed.
+            Defaults to "sklearn".
+        **tsne_kwargs: Additional args for the TSNE class of the chosen backend.
 
     Returns:
         np.ndarray: 2D t-SNE embedding.
     """
-    # Flatten and replace NaNs
-    X_flat = X.reshape(X.shape[0], -1)
-    X_flat = np.nan_to_num(X_flat)
+    # Flatten and cast to float32 once (sklearn's TSNE works in float32 anyway), then replace NaNs
+    # in place unless X_flat is still a view of the caller's float32 array
+    X_flat = np.ascontiguousarray(X.reshape(X.shape[0], -1), dtype=np.float32)
+    X_flat = np.nan_to_num(X_flat, copy=np.may_share_memory(X_flat, X))
 
     # Normalize if requested
     X_proc = _apply_normalization(X_flat, normalization)
 
-    tsne = TSNE(n_components=2, random_state=42, **tsne_kwargs)
-    X_embedded = tsne.fit_transform(X_proc)
+    if backend not in ("auto", "opentsne", "sklearn"):
+        raise ValueError(f"Unknown t-SNE backend: {backend!r}")
+    if backend == "opentsne" and not OPENTSNE_AVAILABLE:
+        raise ImportError("backend='opentsne' requires the openTSNE package.")
+
+    if backend == "opentsne" or (backend == "auto" and OPENTSNE_AVAILABLE):
+        tsne = OpenTSNE(n_components=2, random_state=42, n_jobs=-1, negative_gradient_method="fft", **tsne_kwargs)
+        X_embedded = np.asarray(tsne.fit(X_proc))
+    else:
+        tsne = TSNE(n_components=2, random_state=42, **tsne_kwargs)
+        X_embedded = tsne.fit_transform(X_proc)
 
     if plot:
+        import matplotlib.pyplot as plt
+
         plt.figure(figsize=(8, 6))
         if feature is None:
             plt.scatter(X_embedded[:, 0], X_embedded[:, 1], alpha=0.7)
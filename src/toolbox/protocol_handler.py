@@ -1,24 +1,31 @@
 from dataclasses import dataclass
-from glob import glob
-from os.path import join
-from typing import Union
+from functools import lru_cache
+from typing import Optional, Union
 import json
+import os
+import warnings
 import numpy as np
 
-@dataclass
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+@dataclass(slots=True, frozen=True)
 class Participant:
     Number: str
     age: str
     gender: str
     leg: str
     
-@dataclass
+@dataclass(slots=True, frozen=True)
 class IsokineticMeasurement:
     rotation_velocity: int
     force_levels: np.ndarray
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class EITMeasurement:
     excitation_frequency: Union[int, float]
     burst_count: int
@@ -28,6 +35,23 @@ class EITMeasurement:
     injection_skip: int
     
     
+def _find_protocol(path: str) -> Optional[str]:
+    """
+    Returns the first "*protocol.json" file of a directory (as glob would, hidden files excluded).
+
+    :param path: Directory to search.
+    :return: Path of the protocol file, or None if there is none or the directory cannot be read.
+    """
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.endswith("protocol.json") and not entry.name.startswith(".") and entry.is_file():
+                    return entry.path
+    except OSError:
+        pass
+    return None
+
+
 class Protocol:
     """Handles reading and parsing protocol JSON files for experiments."""
 
@@ -51,13 +75,14 @@ class Protocol:
     def read_json(self):
         """Reads and parses the protocol JSON file."""
         try:
-            json_files = glob(join(self.path, "*protocol.json"))
-            if not json_files:
+            self.json_path = _find_protocol(self.path)
+            if self.json_path is None:
                 raise FileNotFoundError("No protocol JSON file found in the given path.")
-            self.json_path = json_files[0]
 
-            with open(self.json_path, "r", encoding="utf-8") as file:
-                data = json.load(file)
+            # orjson.JSONDecodeError subclasses json.JSONDecodeError, so the handler below covers both
+            with open(self.json_path, "rb") as file:
+                raw = file.read()
+            data = orjson.loads(raw) if ORJSON_AVAILABLE else json.loads(raw.decode("utf-8"))
 
             if self.verbose:
                 print(f"Loaded protocol file: {self.json_path}")
@@ -101,7 +126,34 @@ class Protocol:
         """Parses a force level string into a NumPy array."""
         if isinstance(force_levels, str):
             try:
-                return np.array([int(x) for x in force_levels.strip("[]").split()], dtype=int)
-            except ValueError:
+                # NumPy only warns on unparsable trailing text; escalate so bad input still yields []
+                with warnings.catch_warnings():
+                    warnings.simplefilter("error", DeprecationWarning)
+                    return np.fromstring(force_levels.strip("[] "), dtype=int, sep=" ")
+            except (ValueError, DeprecationWarning):
                 return np.array([])
-        return np.array(force_levels, dtype=int) if force_levels else np.array([])
\ No newline at end of file
+        return np.array(force_levels, dtype=int) if force_levels else np.array([])
+
+
+@lru_cache(maxsize=64)
+def _load_protocol_cached(path: str, json_path: str, mtime_ns: int) -> Protocol:
+    """Parses a Protocol once per (directory, protocol file, modification time); failures are not cached."""
+    protocol = Protocol(path, verbose=False)
+    if protocol.Participant is None:
+        raise ValueError(f"Could not parse protocol JSON: {json_path}")
+    return protocol
+
+
+def load_protocol(path: str) -> Protocol:
+    """
+    Returns the (non-verbose) Protocol of a directory, parsed once per version of its protocol file.
+
+    :param path: Directory containing the protocol JSON file.
+    :return: Cached Protocol instance; it is shared between callers, so treat it as read-only.
+    :raises FileNotFoundError: If the directory has no protocol JSON file.
+    :raises ValueError: If the protocol JSON file cannot be parsed.
+    """
+    json_path = _find_protocol(path)
+    if json_path is None:
+        raise FileNotFoundError(f"No protocol JSON file found in {path}")
+    return _load_protocol_cached(path, json_path, os.stat(json_path).st_mtime_ns)